@@ -0,0 +1,56 @@
+"""
+Numba compiled sampler used by `doubleSlit.waveFunction.measure_batch` for large batches of electrons.
+
+Importing this module requires `numba`. If it is not installed, `doubleSlit` falls back to the NumPy sampler.
+
+
+© 2024 The Coding School, All rights reserved.
+"""
+
+import numpy as np
+from numba import njit, prange
+
+
+_CHUNK = 4096
+"""Number of electrons measured per seeded chunk. Fixed so that results do not depend on the number of threads."""
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _sample(cdf, values, jitter_scale, is_normal, out, seed):
+
+  """Measures `out.size` electrons in a single pass, writing their x coordinates into `out`.
+
+  ###Parameters:
+  <ul>
+    <li>`cdf` (ndarray): The cumulative distribution of the wavefunction over `values`.</li>
+    <li>`values` (ndarray): The positions the wavefunction can collapse to.</li>
+    <li>`jitter_scale` (float): The scale of the noise added to each measurement.</li>
+    <li>`is_normal` (bool): Whether the noise is normally distributed. Otherwise it is uniform in `[-jitter_scale, jitter_scale]`.</li>
+    <li>`out` (ndarray): The array to write the measured positions into.</li>
+    <li>`seed` (int): Seed for Numba's random number generator.</li>
+  </ul>
+
+  ### NOTE:
+  Each chunk of `_CHUNK` electrons reseeds the generator of the thread running it,
+  so the same seed always gives the same measurements.
+  """
+
+  num_chunks = (out.size + _CHUNK - 1)//_CHUNK
+  for chunk in prange(num_chunks):
+    np.random.seed(seed + chunk)
+    for i in range(chunk*_CHUNK, min((chunk + 1)*_CHUNK, out.size)):
+      idx = np.searchsorted(cdf, np.random.random(), side="right")
+      if is_normal:
+        out[i] = values[idx] + np.random.normal()*jitter_scale
+      else:
+        out[i] = values[idx] + (np.random.random()*2 - 1)*jitter_scale
+
+
+# Compile on import so the first beam fired is not dominated by compile time. The tables
+# passed in by `waveFunction` are read only, which Numba compiles as a separate type.
+_cdf = np.array([1.0])
+_values = np.array([0.0])
+_cdf.setflags(write=False)
+_values.setflags(write=False)
+_sample(_cdf, _values, 0.01, False, np.empty(1), 0)
+del _cdf, _values
@@ -1,3 +1,108 @@
+import functools
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+try:
+  from _sampler import _sample
+except ImportError:
+  _sample = None
+
+try:
+  import cupy as cp
+except ImportError:
+  cp = None
+
+
+_POOL_SIZE = 4096
+"""Number of random values drawn at once for electrons fired one at a time."""
+
+
+def _array_module(backend):
+
+  """Returns the array module used for a backend.
+
+  ###Parameters:
+  <ul>
+    <li>`backend` (str): Either `"numpy"` or `"cupy"`.</li>
+  </ul>
+
+  ###Returns:
+  `numpy` or `cupy`.
+
+  ###Raises:
+  `ValueError`
+  Raised if the backend is not recognized.
+
+  `ImportError`
+  Raised if the `"cupy"` backend is requested but CuPy is not installed.
+  """
+
+  if backend == "numpy":
+    return np
+  elif backend == "cupy":
+    if cp is None:
+      raise ImportError("CuPy must be installed to use the cupy backend.")
+    return cp
+  else:
+    raise ValueError(f"Unknown backend {backend!r}. Must be 'numpy' or 'cupy'.")
+
+
+def _to_host(arr):
+  """Copies a CuPy array back to the host. NumPy arrays are returned unchanged."""
+
+  if cp is not None and isinstance(arr, cp.ndarray):
+    return arr.get()
+  return arr
+
+
+def _cos2_integral(x, k, xp=np):
+  """Integral of cos^2(kt) from -10 to `x`, which is the unnormalized CDF of the unmeasured wavefunction.
+  `xp` is the array module `x` belongs to."""
+
+  if k == 0:
+    return x + 10
+  return (x + 10)/2 + (xp.sin(2*k*x) + np.sin(20*k))/(4*k)
+
+
+@functools.lru_cache(maxsize=32)
+def _build_tables(d, distance_to_screen, measure_slit):
+
+  """Builds the positions a wavefunction can collapse to along with their probabilities.
+  Cached so that rebuilding a wavefunction with the same parameters is free.
+
+  ###Parameters:
+  <ul>
+    <li>`d` (float): The distance between the two slits.</li>
+    <li>`distance_to_screen` (float): The distance between the slits and the screen where the particles will be measured.</li>
+    <li>`measure_slit` (bool): Whether to measure which slit the particle goes through or not.</li>
+  </ul>
+
+  ###Returns:
+  A tuple `(values, probs, cdf, norm, k)`, where `k` is pi*d/distance_to_screen. The arrays are shared between wavefunctions and are read only.
+  """
+
+  k = np.pi * d/distance_to_screen
+  if not measure_slit:
+    # The CDF has a closed form, so each probability is exactly the integral
+    # over the bin ending at that value.
+    values = np.linspace(-10,10,num=1000)
+    norm = _cos2_integral(10, k)
+    cdf = _cos2_integral(values, k)/norm
+    cdf[0] = 0.0
+    probs = np.diff(cdf,prepend=0)
+  else:
+    values = np.array([-1*d/2,d/2],dtype=np.float64)
+    norm = 1
+    probs = np.array([0.5,0.5],dtype=np.float64)
+    cdf = np.cumsum(probs)
+
+  cdf[-1] = 1.0
+  for arr in (values, probs, cdf):
+    arr.setflags(write=False)
+  return values, probs, cdf, norm, k
+
+
 class waveFunction():
 
   """
@@ -17,7 +122,7 @@ class waveFunction():
   """Whether to measure which slit the particle goes through or not. Measuring at the slits collapses the wavefunction there instead of at the screen, thereby destroying the wave like nature of the particles."""
 
 
-  def __init__(self,d, distance_to_screen,measure_slit):
+  def __init__(self,d, distance_to_screen,measure_slit, rng=None, backend="numpy", exact=False):
 
     """
     Initializes the double slit wavefunction.
@@ -27,34 +132,37 @@ class waveFunction():
       <li>`d` (float): The distance between the two slits.</li>
       <li>`distance_to_screen` (float): The distance between the slits and the screen where the particles will be measured.</li>
       <li>`measure_slit` (bool): Whether to measure which slit the particle goes through or not.</li>
+      <li>`rng` (numpy.random.Generator or cupy.random.Generator, optional): The random number generator used for measurements. Must match `backend`. Defaults to `None`, which creates a new unseeded generator.</li>
+      <li>`backend` (str, optional): Where to measure electrons, either `"numpy"` for the CPU or `"cupy"` for the GPU. Defaults to `"numpy"`.</li>
+      <li>`exact` (bool, optional): Whether to sample the unmeasured wavefunction exactly from its closed form CDF instead of from its bins. Slower, see `_inverse_cdf()`. Defaults to `False`.</li>
     </ul>
     """
 
     self.d = d
     self.distance_to_screen = distance_to_screen
     self.measure_slit= measure_slit
+    self._exact = exact
+    self._xp = _array_module(backend)
+    self._rng = self._xp.random.default_rng() if rng is None else rng
 
-    if not self.measure_slit:
-      self.values = np.linspace(-10,10,num=1000)
-      self.norm = scipy.integrate.trapezoid(self.evaluate_unnormalized(self.values),self.values)
-      self.probs = [0]
-      self.probs.extend([scipy.integrate.trapezoid(self.evaluate(np.linspace(self.values[i],self.values[i+1],num=100)),np.linspace(self.values[i],self.values[i+1],num=100)) for i in range(999)])
-      self.probs = self.probs/sum(self.probs)
-    else:
-      self.values = [-1*self.d/2,self.d/2]
-      self.norm = 1
-      self.probs = [0.5,0.5]
+    self.values, self.probs, self._cdf, self.norm, self._k = _build_tables(self.d, self.distance_to_screen, self.measure_slit)
+    # Upload the tables once so measurements on the GPU never touch the host. No copy is made for numpy.
+    self._device_values = self._xp.asarray(self.values)
+    self._device_cdf = self._xp.asarray(self._cdf)
+    self._measure_buf = None
+    self._measure_idx = 0
 
-  def evaluate(self,x):
-    """Returns the wavefunction probability distribution evaluated at a specific point. Only used for non-collapsed wavefunctions.
+  def evaluate(self,x,normalize=True):
+    """Returns the wavefunction probability distribution evaluated at a specific point or array of points. Only used for non-collapsed wavefunctions.
 
     ###Parameters:
     <ul>
-      <li>`x` (float): The point to evaluate the wavefunction at.</li>
+      <li>`x` (float or ndarray): The point or points to evaluate the wavefunction at.</li>
+      <li>`normalize` (bool, optional): Whether to normalize the distribution. Defaults to `True`.</li>
     </ul>
     
     ###Returns:
-    The wavefunction evaluated at the provided point.
+    The wavefunction evaluated at the provided points, with the same shape as `x`.
 
 
     ### NOTE:
@@ -62,36 +170,81 @@ class waveFunction():
     probability distribution function.
     """
 
-
+    x = np.asarray(x, dtype=np.float64)
     if not self.measure_slit:
-      return np.cos(np.pi * self.d* x/self.distance_to_screen)**2/self.norm
+      values = np.cos(self._k*x)**2
+      if normalize:
+        values = values/self.norm
     else:
-      if float(x)== float(-1*self.d/2):
-        return 0.5
-      elif float(x)== float(self.d/2):
-        return 0.5
-      else:
-        return 0
+      values = np.zeros_like(x)
+      values[np.isclose(x, -1*self.d/2)] = 0.5
+      values[np.isclose(x, self.d/2)] = 0.5
+    return values[()]
 
 
   def evaluate_unnormalized(self,x):
 
-    """Returns the unnormalized wavefunction probability distribution evaluated at a specific point.
+    """Returns the unnormalized wavefunction probability distribution evaluated at a specific point or array of points.
+    Equivalent to `evaluate(x, normalize=False)`.
 
     ###Parameters:
     <ul>
-      <li>`x` (float): The point to evaluate the wavefunction at.</li>
+      <li>`x` (float or ndarray): The point or points to evaluate the wavefunction at.</li>
     </ul>
     
     ###Returns:
-    The unnormalized wavefunction evaluated at the provided point.
+    The unnormalized wavefunction evaluated at the provided points, with the same shape as `x`.
 
 
     ### NOTE:
     This evaluation method is only used to normalize the wavefunction.
     """
 
-    return np.cos(np.pi * self.d * x/self.distance_to_screen)**2
+    return self.evaluate(x, normalize=False)
+
+
+  def _inverse_cdf(self, u, out=None):
+
+    """Samples the unmeasured wavefunction exactly by inverting its closed form CDF.
+
+    The tabulated CDF brackets each root to a single bin, then Newton's method
+    solves `F(x) = u` inside it. Steps that leave the bracket,
+    which happens close to the zeros of cos^2(kx), fall back to bisection.
+
+    ### NOTE:
+    This takes a few full passes over the samples, so it is several times slower than the
+    binned lookup in `measure_batch()`. It is only used when the wavefunction is created with `exact=True`.
+
+    ###Parameters:
+    <ul>
+      <li>`u` (ndarray): Uniform samples in `[0, 1)`.</li>
+      <li>`out` (ndarray, optional): Array to write the results into. Defaults to `None`, which allocates a new array.</li>
+    </ul>
+
+    ###Returns:
+    An array of positions distributed according to the wavefunction on [-10,10].
+    """
+
+    xp = self._xp
+    idx = xp.searchsorted(self._device_cdf, u, side="right").clip(1, self.values.size - 1)
+    lo = self._device_values[idx - 1]
+    hi = self._device_values[idx]
+    f_lo = self._device_cdf[idx - 1]
+    f_hi = self._device_cdf[idx]
+    x = xp.add(lo, (hi - lo)*(u - f_lo)/(f_hi - f_lo), out=out)
+    for _ in range(64):
+      residual = _cos2_integral(x, self._k, xp)/self.norm - u
+      xp.copyto(lo, x, where=residual <= 0)
+      xp.copyto(hi, x, where=residual > 0)
+      with np.errstate(divide="ignore", invalid="ignore"):
+        step = x - residual*self.norm/xp.cos(self._k*x)**2
+      bisect = ~((step >= lo) & (step <= hi))
+      step[bisect] = (lo[bisect] + hi[bisect])/2
+      converged = (xp.abs(residual) <= 1e-15) | (xp.abs(step - x) < 1e-12) | (hi - lo < 1e-12)
+      x[...] = step
+      if converged.all():
+        break
+    return x
 
 
   def measure(self):
@@ -103,14 +256,58 @@ class waveFunction():
     
     ###Returns:
     The x coordinate of the measured electron.
+
+    ### NOTE:
+    Measurements are drawn `_POOL_SIZE` at a time with `measure_batch()` and handed out one by one,
+    since a single vectorized call costs about as much as a scalar one.
     """
 
-    temp_value = np.random.choice(self.values, p=self.probs)
+    if self._measure_buf is None or self._measure_idx >= self._measure_buf.size:
+      self._measure_buf = self.measure_batch(_POOL_SIZE)
+      self._measure_idx = 0
+    value = self._measure_buf[self._measure_idx]
+    self._measure_idx += 1
+    return value
+
+
+  def measure_batch(self, n, out=None):
+
+    """Collapses the superposition of many electrons at once and finds their detected locations.
+
+    ###Parameters:
+    <ul>
+      <li>`n` (int): The number of electrons to measure.</li>
+      <li>`out` (ndarray, optional): Array of length `n` to write the results into. Defaults to `None`, which allocates a new array.</li>
+    </ul>
+
+    ###Returns:
+    An array of the x coordinates of the measured electrons. This is a CuPy array on the `"cupy"` backend.
+
+    ### NOTE:
+    Every backend samples the same distribution. By default the electrons land on one of the
+    tabulated `values` plus a small amount of noise, and with `exact=True` the unmeasured
+    wavefunction is sampled exactly instead. On the `"numpy"` backend, binned batches over 1000
+    electrons use the Numba sampler when Numba is installed.
+    """
+
+    xp = self._xp
+    if self._exact and not self.measure_slit:
+      return self._inverse_cdf(self._rng.random(n), out=out)
+
+    if xp is np and _sample is not None and n > 1000:
+      if out is None:
+        out = np.empty(n, dtype=np.float64)
+      jitter_scale = 0.2 if self.measure_slit else 0.01
+      _sample(self._cdf, self.values, jitter_scale, self.measure_slit, out, self._rng.integers(2**31))
+      return out
+
+    idx = xp.searchsorted(self._device_cdf, self._rng.random(n), side="right")
+    values = xp.take(self._device_values, idx, out=out)
     if self.measure_slit:
-      temp_value += np.random.normal(scale = 0.2)
+      values += 0.2*self._rng.standard_normal(n)
     else:
-      temp_value += np.random.uniform(low=-0.01,high=0.01)
-    return temp_value
+      values += 0.01*(2*self._rng.random(n) - 1)
+    return values
 
 
 
@@ -149,18 +346,12 @@ class doubleSlit():
   the screen, but makes patterns harder to see unless the number of
   electrons is increased."""
 
-  detections_x: list
-  """Where on the screen's x-axis each particle was measured. For internal use only. <b>SHOULD NOT BE MODIFIED BY USER</b>."""
-  
-  detections_y: list
-  """Where on the screen's y-axis each particle was measured. For internal use only. <b>SHOULD NOT BE MODIFIED BY USER</b>."""
-  
   wavefunction: waveFunction
   """The particle's wavefunction for a given experimental setup. For internal use only. <b>SHOULD NOT BE MODIFIED BY USER</b>."""
 
 
 
-  def __init__(self,slit_dist = 1, distance_to_screen = 10, screen_width = 200, screen_height=100, measure_slit = False):
+  def __init__(self,slit_dist = 1, distance_to_screen = 10, screen_width = 200, screen_height=100, measure_slit = False, seed = None, backend = "numpy", exact = False):
 
     """
     Initializes the double slit experiment.
@@ -172,18 +363,102 @@ class doubleSlit():
       <li>`screen_width` (float, optional): Number of bins along the x axis of the screen. Increases the resolution of the screen, but makes patterns harder to see unless the number of electrons is increased. Defaults to `200`.</li>
       <li>`screen_height` (float, optional): Number of bins along the y axis of the screen. Increases the resolution of the screen, but makes patterns harder to see unless the number of electrons is increased. Defaults to `100`.</li>
       <li>`measure_slit` (bool, optional): Whether to measure which slit the particle goes through or not. Defaults to `False`.</li>
+      <li>`seed` (int, optional): Seed for the random number generator. Experiments created with the same seed detect their electrons at the same places, as long as they use the same `backend` and the same optional packages are installed. Whether Numba is installed changes how large beams are sampled, so the same seed gives different results with and without it. Defaults to `None`, which gives different results every run.</li>
+      <li>`backend` (str, optional): Where to fire electrons, either `"numpy"` for the CPU or `"cupy"` for the GPU. The GPU is only worth it for very large beams, and requires CuPy to be installed. Defaults to `"numpy"`.</li>
+      <li>`exact` (bool, optional): Whether to detect electrons at exactly distributed positions instead of from the binned approximation, which detects each electron at one of 1000 tabulated positions plus a small amount of noise. Several times slower, and the difference is not visible on the screen. Defaults to `False`.</li>
     </ul>
+
+    ###Raises:
+    `ValueError`
+    Raised if `backend` is not recognized.
+
+    `ImportError`
+    Raised if `backend` is `"cupy"` but CuPy is not installed.
     """
 
     self.slit_dist = slit_dist
     self.distance_to_screen = distance_to_screen
-    self.detections_x = []
-    self.detections_y = []
     self.screen_width = screen_width
     self.screen_height = screen_height
     self.measure_slit = measure_slit
+    self._backend = backend
+    self._exact = exact
+    self._xp = _array_module(backend)
+    self._rng = self._xp.random.default_rng(seed)
+    self._normal_buf = None
+    self._normal_idx = 0
+    self._reset_screen()
+
+    self.wavefunction = waveFunction(self.slit_dist, self.distance_to_screen,self.measure_slit, rng=self._rng, backend=self._backend, exact=self._exact)
+
+
+  @property
+  def detections_x(self):
+    """Where on the screen's x-axis each particle was measured. This is a CuPy array on the `"cupy"` backend. For internal use only. <b>SHOULD NOT BE MODIFIED BY USER</b>."""
+    return self._detections_x[:self._n]
+
+
+  @property
+  def detections_y(self):
+    """Where on the screen's y-axis each particle was measured. This is a CuPy array on the `"cupy"` backend. For internal use only. <b>SHOULD NOT BE MODIFIED BY USER</b>."""
+    return self._detections_y[:self._n]
+
+
+  def _reset_screen(self):
+    """Empties the detection buffers and the screen histogram, and recomputes the screen's bin edges."""
+
+    self._detections_x = self._xp.empty(0, dtype=np.float64)
+    self._detections_y = self._xp.empty(0, dtype=np.float64)
+    self._n = 0
+    self._reset_hist()
+
+
+  def _reset_hist(self):
+    """Empties the screen histogram and recomputes the screen's bin edges from `screen_width` and `screen_height`."""
+
+    self._xedges = np.linspace(-10, 10, self.screen_width+1)
+    self._yedges = np.linspace(-5, 5, self.screen_height+1)
+    self._hist = np.zeros((self.screen_width, self.screen_height))
+    self._hist_n = 0
+
 
-    self.wavefunction = waveFunction(self.slit_dist, self.distance_to_screen,self.measure_slit)
+  def _reserve(self, num_electrons):
+    """Grows the detection buffers so they can hold `num_electrons` more detections.
+    The capacity at least doubles each time so firing electrons one at a time stays cheap."""
+
+    needed = self._n + num_electrons
+    if needed <= self._detections_x.size:
+      return
+    capacity = max(needed, 2*self._detections_x.size)
+    for name in ("_detections_x", "_detections_y"):
+      buffer = self._xp.empty(capacity, dtype=np.float64)
+      buffer[:self._n] = getattr(self, name)[:self._n]
+      setattr(self, name, buffer)
+
+
+  def _validate(self):
+    """Checks that the `doubleSlit` attributes still match those of the `waveFunction` object.
+
+    ###Raises:
+    `ValueError`
+    Raised if `slit_dist` or `distance_to_screen` have been modified. See `clear_screen()`.
+    """
+
+    if self.slit_dist != self.wavefunction.d:
+      raise ValueError("slit_dist attribute has been modified. Screen must be cleared.")
+    elif self.distance_to_screen != self.wavefunction.distance_to_screen:
+      raise ValueError("distance_to_screen attribute has been modified. Screen must be cleared.")
+
+
+  def _next_normal(self, scale):
+    """Returns a normally distributed value with standard deviation `scale`, drawn from a pool of `_POOL_SIZE` values."""
+
+    if self._normal_buf is None or self._normal_idx >= self._normal_buf.size:
+      self._normal_buf = self._rng.standard_normal(_POOL_SIZE)
+      self._normal_idx = 0
+    value = self._normal_buf[self._normal_idx]*scale
+    self._normal_idx += 1
+    return value
 
 
   def fire_electron(self):
@@ -201,14 +476,11 @@ class doubleSlit():
     and no longer match those of the `waveFunction` object. See `clear_screen()`.
     """
 
-    if self.slit_dist != self.wavefunction.d:
-      raise ValueError("slit_dist attribute has been modified. Screen must be cleared.")
-    elif self.distance_to_screen != self.wavefunction.distance_to_screen:
-      raise ValueError("distance_to_screen attribute has been modified. Screen must be cleared.")
-
-    detected_x = self.distance_to_screen*np.tan(self.wavefunction.measure())
-    self.detections_x.append(self.wavefunction.measure())
-    self.detections_y.append(np.random.normal(scale=1.7))
+    self._validate()
+    self._reserve(1)
+    self._detections_x[self._n] = self.wavefunction.measure()
+    self._detections_y[self._n] = self._next_normal(1.7)
+    self._n += 1
 
 
   def electron_beam(self, num_electrons = 5000):
@@ -228,12 +500,12 @@ class doubleSlit():
     and no longer match those of the `waveFunction` object. See `clear_screen()`.
     """
 
-    if self.slit_dist != self.wavefunction.d:
-      raise ValueError("slit_dist attribute has been modified. Screen must be cleared.")
-    elif self.distance_to_screen != self.wavefunction.distance_to_screen:
-      raise ValueError("distance_to_screen attribute has been modified. Screen must be cleared.")
-    for i in range(num_electrons):
-      self.fire_electron()
+    self._validate()
+    self._reserve(num_electrons)
+    new = slice(self._n, self._n + num_electrons)
+    self.wavefunction.measure_batch(num_electrons, out=self._detections_x[new])
+    self._detections_y[new] = 1.7*self._rng.standard_normal(num_electrons)
+    self._n += num_electrons
 
  
   def show_screen(self):
@@ -246,7 +518,18 @@ class doubleSlit():
     None
     """
 
-    plt.hist2d(self.detections_x,self.detections_y,[self.screen_width,self.screen_height],range=[[-10,10],[-5,5]])
+    if self._hist.shape != (self.screen_width, self.screen_height):
+      self._reset_hist()
+
+    # Only bin the electrons detected since the screen was last shown. On the GPU
+    # only the histogram is copied back, never the detections themselves.
+    new = slice(self._hist_n, self._n)
+    xp = self._xp
+    counts = xp.histogram2d(self._detections_x[new], self._detections_y[new], bins=[xp.asarray(self._xedges), xp.asarray(self._yedges)])[0]
+    self._hist += _to_host(counts)
+    self._hist_n = self._n
+
+    plt.pcolormesh(self._xedges, self._yedges, self._hist.T)
     plt.minorticks_on()
     plt.show()
 
@@ -263,9 +546,8 @@ class doubleSlit():
 
     """
 
-    self.detections_x = []
-    self.detections_y = []
-    self.wavefunction = waveFunction(self.slit_dist, self.distance_to_screen,self.measure_slit)
+    self._reset_screen()
+    self.wavefunction = waveFunction(self.slit_dist, self.distance_to_screen,self.measure_slit, rng=self._rng, backend=self._backend, exact=self._exact)
 
 
   def show_hist(self):
@@ -279,7 +561,10 @@ class doubleSlit():
 
     """
 
-    plt.hist(self.detections_x,bins=self.screen_width)
+    # Bin on the device so only the counts are copied back, then draw them as the same bars plt.hist would.
+    counts, edges = self._xp.histogram(self.detections_x,bins=self.screen_width)
+    edges = _to_host(edges)
+    plt.hist(edges[:-1],bins=edges,weights=_to_host(counts))
     plt.xlabel("Distance from center")
     plt.ylabel("Number of Electrons Detected")
     plt.minorticks_on()